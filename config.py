@@ -37,3 +37,32 @@ FILTER_REFERENCE_CHUNKS = True
 SEARCH_FETCH_MULTIPLIER = 8  # query 时先取 top_k*6，再过滤 refs
 # ---- Search diversification (group by paper) ----
 SNIPPETS_PER_PAPER = 2          # 每篇论文展示几个片段
+
+# ---- HNSW index settings (per collection) ----
+# 仅在 collection 创建时生效；修改后需执行 rebuild_index 才会迁移到新设置
+# space: "cosine" | "l2" | "ip"（向量均已归一化，推荐 cosine）
+HNSW_SETTINGS = {
+    "papers": {"space": "cosine", "M": 16, "construction_ef": 200, "search_ef": 64},
+    "images": {"space": "cosine", "M": 16, "construction_ef": 100, "search_ef": 32},
+}
+# tune_index 扫描的参数网格（每组参数在内存中临时建一次索引）
+HNSW_TUNE_GRID = {
+    "M": [8, 16, 32],
+    "construction_ef": [100, 200],
+    "search_ef": [16, 32, 64, 128],
+}
+HNSW_TUNE_QUERIES = 100          # 从当前索引里抽样多少个向量作为 query
+HNSW_TUNE_TOP_K = 10             # recall@k 的 k
+
+# ---- Query caching ----
+QUERY_EMBED_CACHE_SIZE = 1024                 # 内存 LRU：query embedding 条数
+QUERY_EMBED_CACHE_DIR = STORAGE_DIR / "query_cache"   # 设为 None 关闭磁盘缓存
+QUERY_EMBED_CACHE_DISK_MAX = 20000            # 磁盘缓存最多保留条数（按最近使用淘汰，0 不限）
+RESULT_CACHE_SIZE = 256                       # 检索结果 LRU 条数（add/remove/rebuild 后自动失效）
+CACHE_STATS_FILE = STORAGE_DIR / "cache_stats.json"   # 各缓存命中计数（跨进程累计），设为 None 不落盘
+
+# ---- Image thumbnail cache (CLIP 输入) ----
+THUMBNAIL_DIR = STORAGE_DIR / "thumbnails"    # 设为 None 则直接读原图
+THUMBNAIL_SIZE = 224                          # 短边缩放到该尺寸（与 CLIP 预处理一致）
+THUMBNAIL_QUALITY = 95                        # 缩略图 JPEG 质量
+THUMBNAIL_WORKERS = 8                         # 并行生成缩略图的线程数
@@ -8,13 +8,35 @@ from PIL import Image
 from sentence_transformers import SentenceTransformer
 from transformers import CLIPModel, CLIPProcessor
 
+from query_cache import EmbeddingCache
+
 
 LOGGER = logging.getLogger(__name__)
 
 
+def tokenizer_is_uncased(tokenizer) -> bool:
+    # 大小写不同的同一句话编码成相同 token 才算不区分大小写（BERT uncased / CLIP BPE 都是）
+    try:
+        return tokenizer("Query Case Probe")["input_ids"] == tokenizer("query case probe")["input_ids"]
+    except Exception:  # pragma: no cover - defensive
+        return False
+
+
 class EmbeddingManager:
-    def __init__(self, text_model_path: Path, clip_model_path: Path, device: Optional[str] = None) -> None:
+    def __init__(
+        self,
+        text_model_path: Path,
+        clip_model_path: Path,
+        device: Optional[str] = None,
+        query_cache_size: int = 0,
+        query_cache_dir: Optional[Path] = None,
+        query_cache_disk_max: int = 0,
+        cache_stats_file: Optional[Path] = None,
+    ) -> None:
         self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.text_model_path = text_model_path
+        self.clip_model_path = clip_model_path
+        self.query_cache = EmbeddingCache(query_cache_size, query_cache_dir, query_cache_disk_max, cache_stats_file)
         LOGGER.info("Loading text model from %s", text_model_path)
         self.text_model = SentenceTransformer(str(text_model_path), device=self.device)
 
@@ -23,6 +45,10 @@ class EmbeddingManager:
         self.clip_processor = CLIPProcessor.from_pretrained(str(clip_model_path), local_files_only=True)
         self.clip_model.to(self.device)
 
+        # 缓存 key 是否可以忽略大小写（换成 cased 模型时自动区分）
+        self.text_uncased = tokenizer_is_uncased(self.text_model.tokenizer)
+        self.clip_uncased = tokenizer_is_uncased(self.clip_processor.tokenizer)
+
     def embed_text(self, texts: Iterable[str]) -> np.ndarray:
         texts_list = list(texts)
         if not texts_list:
@@ -35,6 +61,30 @@ class EmbeddingManager:
         )
         return vectors
 
+    def embed_query(self, query: str) -> np.ndarray:
+        # 单条检索 query 的文本向量（带缓存），返回 (D,) 只读数组
+        return self.query_cache.get_or_compute(
+            f"text:{self.text_model_path}",
+            query,
+            lambda q: self.embed_text([q]).squeeze(0),
+            lowercase=self.text_uncased,
+        )
+
+    def embed_clip_query(self, query: str) -> np.ndarray:
+        # 单条以文搜图 query 的 CLIP 文本向量（带缓存），返回 (D,) 只读数组
+        return self.query_cache.get_or_compute(
+            f"clip:{self.clip_model_path}",
+            query,
+            lambda q: self.embed_clip_text([q]).squeeze(0),
+            lowercase=self.clip_uncased,
+        )
+
+    def embed_clip_queries(self, queries: List[str]) -> np.ndarray:
+        # 多条 CLIP 文本 query：缓存未命中的部分合并成一次前向，返回 (Q, D)
+        return self.query_cache.get_or_compute_many(
+            f"clip:{self.clip_model_path}", queries, self.embed_clip_text, lowercase=self.clip_uncased
+        )
+
     def embed_clip_text(self, texts: List[str]) -> np.ndarray:
         inputs = self.clip_processor(text=texts, return_tensors="pt", padding=True, truncation=True)
         inputs = {k: v.to(self.device) for k, v in inputs.items()}
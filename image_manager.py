@@ -1,18 +1,118 @@
+import hashlib
 import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional, Sequence, Tuple
 
+import numpy as np
+from PIL import Image
+
+import config
 from embeddings import EmbeddingManager
+from query_cache import EmbeddingCache, ResultCache, normalize_query
 from vector_store import VectorStore
 
 
 LOGGER = logging.getLogger(__name__)
 
+_HASH_BLOCK = 1 << 20
+
+
+def content_hash(path: Path) -> str:
+    # 按文件内容哈希：同一张图改名/移动后仍命中缩略图缓存
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def make_thumbnail(src: Path, dest: Path, size: int, quality: int) -> None:
+    """
+    Decode `src` and save an RGB JPEG whose short side is `size` (never upscaled).
+    JPEGs use PIL draft mode so the decoder itself downsamples (1/2, 1/4, 1/8 DCT scaling).
+    """
+    with Image.open(src) as img:
+        if img.format == "JPEG":
+            # draft 只会缩到 >= 请求尺寸，短边仍 >= size
+            img.draft("RGB", (size, size))
+        img = img.convert("RGB")
+        w, h = img.size
+        scale = size / float(min(w, h))
+        if scale < 1.0:
+            img = img.resize((max(size, round(w * scale)), max(size, round(h * scale))), Image.BICUBIC)
+        tmp = dest.with_suffix(f".{os.getpid()}-{threading.get_ident()}.tmp")
+        try:
+            img.save(tmp, format="JPEG", quality=quality)
+            os.replace(tmp, dest)
+        except Exception:
+            tmp.unlink(missing_ok=True)
+            raise
+
+
+def _where_in(key: str, values: List[str]) -> Dict:
+    return {key: values[0]} if len(values) == 1 else {key: {"$in": values}}
+
+
+def _is_same_image(meta: Dict, digest: str, path: str) -> bool:
+    if meta.get("sha1"):
+        return meta.get("sha1") == digest
+    return meta.get("path") == path
+
 
 class ImageManager:
     def __init__(self, embedding_manager: EmbeddingManager, store: VectorStore) -> None:
         self.embedding_manager = embedding_manager
         self.store = store
+        self.result_cache = ResultCache(
+            int(getattr(config, "RESULT_CACHE_SIZE", 0)),
+            stats_file=getattr(config, "CACHE_STATS_FILE", None),
+            section="image_results",
+        )
+        # 缩略图缓存：<THUMBNAIL_DIR>/<sha1>_<size>q<quality>.jpg，改尺寸/质量会自动生成新缩略图
+        thumb_dir = getattr(config, "THUMBNAIL_DIR", None)
+        self.thumbnail_dir: Optional[Path] = Path(thumb_dir) if thumb_dir else None
+        self.thumbnail_size = int(getattr(config, "THUMBNAIL_SIZE", 224))
+        self.thumbnail_quality = int(getattr(config, "THUMBNAIL_QUALITY", 95))
+        self.thumbnail_workers = int(getattr(config, "THUMBNAIL_WORKERS", 8))
+
+    def thumbnail_path(self, digest: str) -> Path:
+        return self.thumbnail_dir / f"{digest}_{self.thumbnail_size}q{self.thumbnail_quality}.jpg"
+
+    def _thumbnail_for(self, path: Path, digest: Optional[str] = None) -> Tuple[str, Path]:
+        digest = digest or content_hash(path)
+        if self.thumbnail_dir is None:
+            return digest, path
+        thumb = self.thumbnail_path(digest)
+        if not thumb.exists():
+            try:
+                make_thumbnail(path, thumb, self.thumbnail_size, self.thumbnail_quality)
+            except Exception as exc:  # pragma: no cover - defensive
+                LOGGER.warning("Thumbnail failed for %s, using original: %s", path, exc)
+                return digest, path
+        return digest, thumb
+
+    def ensure_thumbnails(
+        self, images: List[Path], digests: Optional[List[str]] = None
+    ) -> List[Tuple[str, Path]]:
+        """
+        Return (content hash, CLIP-ready image path) per input, generating missing thumbnails in parallel.
+        Pass `digests` when the content hashes are already known to skip re-hashing.
+        """
+        if self.thumbnail_dir is not None:
+            self.thumbnail_dir.mkdir(parents=True, exist_ok=True)
+        workers = max(1, min(self.thumbnail_workers, len(images)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(self._thumbnail_for, images, digests or [None] * len(images)))
+
+    def _hash_images(self, images: List[Path]) -> List[str]:
+        workers = max(1, min(self.thumbnail_workers, len(images)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(content_hash, images))
 
     def index_folder(self, folder: Path) -> List[Path]:
         folder = folder.expanduser().resolve()
@@ -20,8 +120,9 @@ class ImageManager:
         if not images:
             LOGGER.info("No images found in %s", folder)
             return []
-        embeddings = self.embedding_manager.embed_images(images)
-        import hashlib
+        # 编码缓存好的小图而不是原图，重建索引/换模型时不再重复解码大图
+        thumbs = self.ensure_thumbnails(images)
+        embeddings = self.embedding_manager.embed_images([thumb for _, thumb in thumbs])
 
         def _file_id(p: Path) -> str:
             h = hashlib.sha1()
@@ -32,26 +133,193 @@ class ImageManager:
             return h.hexdigest()[:20]
 
         ids = [_file_id(p) for p in images]
-        metadatas = [{"path": str(p)} for p in images]
+        metadatas = [{"path": str(p), "sha1": digest} for p, (digest, _) in zip(images, thumbs)]
         captions = [p.name for p in images]
         self.store.upsert(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=captions)
         LOGGER.info("Indexed %d images from %s", len(images), folder)
         return images
 
-    def search_by_text(self, query: str, top_k: int) -> List[Dict[str, str]]:
-        query_embedding = self.embedding_manager.embed_clip_text([query]).squeeze(0)
-        raw = self.store.query(query_embedding, top_k)
-        results: List[Dict[str, str]] = []
-        ids = raw.get("ids", [[]])[0]
-        documents = raw.get("documents", [[]])[0]
-        metadatas = raw.get("metadatas", [[]])[0]
+    def _format_results(
+        self, raw: Dict, row: int = 0, skip: Optional[Tuple[str, str]] = None
+    ) -> List[Dict]:
+        # skip=(sha1, path)：剔除查询图自身；没有 sha1 的旧条目按 path 判断
+        ids = (raw.get("ids") or [[]])[row]
+        documents = (raw.get("documents") or [[]])[row]
+        metadatas = (raw.get("metadatas") or [[]])[row]
+        distances = (raw.get("distances") or [[]] * (row + 1))[row] or []
+        results: List[Dict] = []
         for idx, caption in enumerate(documents):
             meta = metadatas[idx] if idx < len(metadatas) else {}
+            if skip and _is_same_image(meta, *skip):
+                continue
             results.append(
                 {
                     "id": ids[idx] if idx < len(ids) else "",
                     "caption": caption,
                     "path": meta.get("path", ""),
+                    "score": self.store.distance_to_score(distances[idx]) if idx < len(distances) else 0.0,
                 }
             )
         return results
+
+    def search_by_text(self, query: str, top_k: int) -> List[Dict]:
+        cache_key = ("text", normalize_query(query, self.embedding_manager.clip_uncased), int(top_k))
+        generation = self.store.generation
+        cached = self.result_cache.get(cache_key, generation)
+        if cached is not None:
+            return cached
+
+        query_embedding = self.embedding_manager.embed_clip_query(query)
+        raw = self.store.query(query_embedding, top_k)
+        results = self._format_results(raw)
+        self.result_cache.put(cache_key, generation, results)
+        return results
+
+    def embed_query_images(
+        self, image_paths: List[Path], digests: Optional[List[str]] = None
+    ) -> Tuple[List[str], np.ndarray, List[int]]:
+        """
+        CLIP vectors for query images. Images already in the index reuse their stored
+        vector (matched by content hash, or by path for entries indexed before hashes were
+        stored); only the rest get thumbnails and are embedded, in one batch.
+        Returns (content hashes, (N, D) vectors, number of stored copies of each query image).
+        """
+        paths = [p.expanduser().resolve() for p in image_paths]
+        digests = list(digests) if digests is not None else self._hash_images(paths)
+        unique = list(dict.fromkeys(digests))
+        stored: Dict[str, np.ndarray] = {}
+        copies: Dict[str, int] = defaultdict(int)
+        if unique:
+            for meta, vec in self.store.find_embeddings(_where_in("sha1", unique)):
+                stored.setdefault(meta.get("sha1", ""), vec)
+                copies[meta.get("sha1", "")] += 1
+
+        # 旧索引（未写 sha1）兜底：只对 sha1 没查到的查询图按 path 再查一次
+        unresolved = {d for d in unique if d not in stored}
+        if unresolved:
+            digest_of = {str(p): d for p, d in zip(paths, digests) if d in unresolved}
+            legacy = 0
+            for meta, vec in self.store.find_embeddings(_where_in("path", list(digest_of))):
+                if meta.get("sha1"):
+                    continue
+                digest = digest_of.get(meta.get("path", ""))
+                if digest is None:
+                    continue
+                stored.setdefault(digest, vec)
+                copies[digest] += 1
+                legacy += 1
+            if legacy:
+                LOGGER.warning(
+                    "%d indexed image(s) have no content hash (indexed by an older version); "
+                    "run rebuild_index so query images are matched by content",
+                    legacy,
+                )
+
+        missing = [d for d in unique if d not in stored]
+        if missing:
+            path_of = dict(zip(digests, paths))
+            thumbs = self.ensure_thumbnails([path_of[d] for d in missing], missing)
+            fresh = self.embedding_manager.embed_images([thumb for _, thumb in thumbs])
+            stored.update(zip(missing, fresh.astype(np.float32)))
+        LOGGER.info("Query images: %d reused from index, %d embedded", len(unique) - len(missing), len(missing))
+        vectors = np.stack([stored[d] for d in digests]) if digests else np.empty((0, 0), dtype=np.float32)
+        return digests, vectors, [copies[d] for d in digests]
+
+    def search_by_image(self, image_path: Path, top_k: int, include_self: bool = False) -> List[Dict]:
+        image_path = image_path.expanduser().resolve()
+        digest = content_hash(image_path)
+        cache_key = ("image", digest, int(top_k), bool(include_self))
+        generation = self.store.generation
+        cached = self.result_cache.get(cache_key, generation)
+        if cached is not None:
+            return cached
+
+        _, vectors, copies = self.embed_query_images([image_path], [digest])
+        # 查询图本身（可能以多个路径入库）会排在最前，按入库份数多取再剔除
+        skip = None if include_self else (digest, str(image_path))
+        raw = self.store.query(vectors[0], top_k if include_self else top_k + copies[0])
+        results = self._format_results(raw, skip=skip)[:top_k]
+        self.result_cache.put(cache_key, generation, results)
+        return results
+
+    def search_batch(
+        self,
+        texts: Sequence[str],
+        image_paths: Sequence[Path],
+        top_k: int,
+        include_self: bool = False,
+    ) -> List[Dict]:
+        """
+        Score many text and/or image queries against the image collection at once:
+        one CLIP text forward pass, one image forward pass (only for unindexed images)
+        and one multi-query store lookup.
+        """
+        texts = list(texts)
+        image_paths = [Path(p).expanduser().resolve() for p in image_paths]
+        parts: List[np.ndarray] = []
+        digests: List[str] = []
+        copies: List[int] = []
+        if texts:
+            parts.append(np.asarray(self.embedding_manager.embed_clip_queries(texts), dtype=np.float32))
+        if image_paths:
+            digests, image_vecs, copies = self.embed_query_images(image_paths)
+            parts.append(image_vecs)
+        if not parts:
+            return []
+
+        queries = np.concatenate(parts, axis=0)
+        fetch_k = top_k if include_self or not copies else top_k + max(copies)
+        raw = self.store.query_many(queries, fetch_k)
+
+        batch: List[Dict] = []
+        for row, text in enumerate(texts):
+            batch.append({"type": "text", "query": text, "results": self._format_results(raw, row)[:top_k]})
+        for offset, (path, digest) in enumerate(zip(image_paths, digests)):
+            skip = None if include_self else (digest, str(path))
+            results = self._format_results(raw, len(texts) + offset, skip=skip)[:top_k]
+            batch.append({"type": "image", "query": str(path), "results": results})
+        return batch
+
+    def benchmark_batch(
+        self, texts: Sequence[str], image_paths: Sequence[Path], top_k: int, repeat: int = 3
+    ) -> Dict:
+        """
+        Time search_batch against looping search_by_text / search_by_image over the same queries.
+        Query-embedding and result caches are disabled so both sides do the full work.
+        """
+        texts = list(texts)
+        image_paths = [Path(p) for p in image_paths]
+        n_queries = len(texts) + len(image_paths)
+
+        def _loop() -> None:
+            for text in texts:
+                self.search_by_text(text, top_k)
+            for path in image_paths:
+                self.search_by_image(path, top_k)
+
+        def _batch() -> None:
+            self.search_batch(texts, image_paths, top_k)
+
+        saved = (self.result_cache, self.embedding_manager.query_cache)
+        self.result_cache = ResultCache(0)
+        self.embedding_manager.query_cache = EmbeddingCache(0)
+        try:
+            timings: Dict[str, float] = {}
+            for name, fn in (("loop", _loop), ("batch", _batch)):
+                fn()  # warm-up
+                t0 = time.perf_counter()
+                for _ in range(max(1, repeat)):
+                    fn()
+                timings[name] = (time.perf_counter() - t0) / max(1, repeat)
+        finally:
+            self.result_cache, self.embedding_manager.query_cache = saved
+
+        return {
+            "queries": n_queries,
+            "repeat": max(1, repeat),
+            "loop_s": timings["loop"],
+            "batch_s": timings["batch"],
+            "loop_qps": n_queries / timings["loop"] if timings["loop"] else 0.0,
+            "batch_qps": n_queries / timings["batch"] if timings["batch"] else 0.0,
+            "speedup": timings["loop"] / timings["batch"] if timings["batch"] else 0.0,
+        }
@@ -0,0 +1,129 @@
+import itertools
+import logging
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import chromadb
+
+from vector_store import VectorStore, hnsw_metadata
+
+
+LOGGER = logging.getLogger(__name__)
+
+_ADD_BATCH = 1000
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int, space: str) -> np.ndarray:
+    """
+    Brute-force k-NN in the same distance space Chroma uses.
+    Returns (Q, k) row indices into `vectors`, nearest first.
+    """
+    if space == "cosine":
+        v = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        q = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        dists = 1.0 - q @ v.T
+    elif space == "ip":
+        dists = 1.0 - queries @ vectors.T
+    else:
+        # squared l2
+        dists = (
+            (queries ** 2).sum(axis=1, keepdims=True)
+            - 2.0 * queries @ vectors.T
+            + (vectors ** 2).sum(axis=1)[None, :]
+        )
+    k = min(k, vectors.shape[0])
+    part = np.argpartition(dists, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(dists, part, axis=1).argsort(axis=1)
+    return np.take_along_axis(part, order, axis=1)
+
+
+def _grid(grid: Dict[str, Sequence[Any]]) -> List[Dict[str, Any]]:
+    keys = list(grid.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def tune_hnsw(
+    store: VectorStore,
+    grid: Dict[str, Sequence[Any]],
+    top_k: int,
+    n_queries: int,
+    space: Optional[str] = None,
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    """
+    Sweep HNSW settings on a copy of the store's vectors and report recall@k vs latency.
+
+    Queries are sampled from the indexed vectors and held out of both the built collections
+    and the brute-force ground truth, so no query can trivially find itself.
+    Each setting is built in a throwaway in-memory collection, the persistent index is untouched.
+    """
+    all_ids, all_vectors = store.get_all_embeddings()
+    if len(all_ids) < 2:
+        LOGGER.info("Collection %s has too few vectors to tune", store.collection.name)
+        return []
+
+    space = space or store.space
+    rng = np.random.default_rng(seed)
+    # 至多留出一半做 query，保证剩下的库不为空
+    n_held = max(1, min(n_queries, len(all_ids) // 2))
+    q_idx = rng.choice(len(all_ids), size=n_held, replace=False)
+    keep = np.ones(len(all_ids), dtype=bool)
+    keep[q_idx] = False
+    queries = all_vectors[q_idx]
+    ids = [i for i, k in zip(all_ids, keep) if k]
+    vectors = all_vectors[keep]
+    top_k = min(top_k, len(ids))
+
+    # 暴力检索也逐条计时，和下面 HNSW 的单条 query 延迟口径一致
+    truth_sets = []
+    exact_latencies: List[float] = []
+    for q in queries:
+        t0 = time.perf_counter()
+        row = exact_top_k(vectors, q[None, :], top_k, space)[0]
+        exact_latencies.append((time.perf_counter() - t0) * 1000.0)
+        truth_sets.append({ids[j] for j in row})
+    exact_p50 = float(np.percentile(exact_latencies, 50))
+    exact_p95 = float(np.percentile(exact_latencies, 95))
+
+    client = chromadb.EphemeralClient()
+    results: List[Dict[str, Any]] = []
+    for params in _grid(grid):
+        settings = {"space": space, **params}
+        name = f"tune-{uuid.uuid4().hex[:12]}"
+        collection = client.create_collection(
+            name=name, embedding_function=None, metadata=hnsw_metadata(settings)
+        )
+        try:
+            t0 = time.perf_counter()
+            for start in range(0, len(ids), _ADD_BATCH):
+                collection.add(
+                    ids=ids[start : start + _ADD_BATCH],
+                    embeddings=vectors[start : start + _ADD_BATCH].tolist(),
+                )
+            build_s = time.perf_counter() - t0
+
+            hits = 0
+            latencies: List[float] = []
+            for q, expected in zip(queries, truth_sets):
+                t0 = time.perf_counter()
+                raw = collection.query(query_embeddings=[q.tolist()], n_results=top_k, include=["distances"])
+                latencies.append((time.perf_counter() - t0) * 1000.0)
+                hits += len(expected.intersection(raw.get("ids", [[]])[0]))
+        finally:
+            client.delete_collection(name=name)
+
+        results.append(
+            {
+                **settings,
+                "recall": hits / float(top_k * len(queries)),
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p95_ms": float(np.percentile(latencies, 95)),
+                "build_s": build_s,
+                "exact_p50_ms": exact_p50,
+                "exact_p95_ms": exact_p95,
+            }
+        )
+        LOGGER.info("Tuned %s -> recall@%d=%.4f", settings, top_k, results[-1]["recall"])
+    return results
@@ -1,11 +1,13 @@
 import argparse
+import json
 import logging
 from pathlib import Path
-from typing import Tuple
+from typing import List, Tuple
 
 import config
 from embeddings import EmbeddingManager
 from image_manager import ImageManager
+from index_tuning import tune_hnsw
 from paper_manager import PaperManager
 from vector_store import VectorStore
 
@@ -15,9 +17,16 @@ LOGGER = logging.getLogger(__name__)
 
 
 def build_managers() -> Tuple[PaperManager, ImageManager]:
-    embedding_manager = EmbeddingManager(config.TEXT_MODEL_PATH, config.CLIP_MODEL_PATH)
-    paper_store = VectorStore(config.PAPER_DB, "papers")
-    image_store = VectorStore(config.IMAGE_DB, "images")
+    embedding_manager = EmbeddingManager(
+        config.TEXT_MODEL_PATH,
+        config.CLIP_MODEL_PATH,
+        query_cache_size=config.QUERY_EMBED_CACHE_SIZE,
+        query_cache_dir=config.QUERY_EMBED_CACHE_DIR,
+        query_cache_disk_max=config.QUERY_EMBED_CACHE_DISK_MAX,
+        cache_stats_file=config.CACHE_STATS_FILE,
+    )
+    paper_store = VectorStore(config.PAPER_DB, "papers", hnsw=config.HNSW_SETTINGS.get("papers"))
+    image_store = VectorStore(config.IMAGE_DB, "images", hnsw=config.HNSW_SETTINGS.get("images"))
     paper_manager = PaperManager(embedding_manager, paper_store)
     image_manager = ImageManager(embedding_manager, image_store)
     return paper_manager, image_manager
@@ -46,15 +55,72 @@ def handle_search_paper(args: argparse.Namespace, paper_manager: PaperManager) -
         print("-" * 60)
 
 
-def handle_search_image(args: argparse.Namespace, image_manager: ImageManager) -> None:
+def _ensure_image_index(image_manager: ImageManager) -> None:
     if image_manager.store.count() == 0:
         LOGGER.info("Image index empty, indexing %s", config.IMAGE_DIR)
         image_manager.index_folder(config.IMAGE_DIR)
+
+
+def handle_search_image(args: argparse.Namespace, image_manager: ImageManager) -> None:
+    _ensure_image_index(image_manager)
     results = image_manager.search_by_text(args.query, args.top_k)
     for rank, item in enumerate(results, start=1):
         print(f"[{rank}] {item['path']} ({item['caption']})")
 
 
+def _check_query_images(paths: List[str]) -> None:
+    bad = [p for p in paths if not Path(p).expanduser().is_file()]
+    if bad:
+        raise SystemExit(f"Query image not found: {', '.join(bad)}")
+
+
+def handle_search_image_by_image(args: argparse.Namespace, image_manager: ImageManager) -> None:
+    _check_query_images([args.path])
+    _ensure_image_index(image_manager)
+    results = image_manager.search_by_image(Path(args.path), args.top_k, include_self=args.include_self)
+    print(json.dumps({"query": args.path, "results": results}, ensure_ascii=False, indent=2))
+
+
+def handle_search_image_batch(args: argparse.Namespace, image_manager: ImageManager) -> None:
+    if not args.text and not args.image:
+        raise SystemExit("search_image_batch needs at least one --text or --image")
+    _check_query_images(args.image)
+    _ensure_image_index(image_manager)
+    image_paths = [Path(p) for p in args.image]
+    batch = image_manager.search_batch(args.text, image_paths, args.top_k, args.include_self)
+    if args.benchmark:
+        timing = image_manager.benchmark_batch(args.text, image_paths, args.top_k, repeat=args.repeat)
+        print(json.dumps({"benchmark": timing, "results": batch}, ensure_ascii=False, indent=2))
+        return
+    print(json.dumps(batch, ensure_ascii=False, indent=2))
+
+
+def handle_tune_index(args: argparse.Namespace, paper_manager: PaperManager, image_manager: ImageManager) -> None:
+    store = paper_manager.store if args.collection == "papers" else image_manager.store
+    results = tune_hnsw(
+        store,
+        grid=config.HNSW_TUNE_GRID,
+        top_k=args.top_k,
+        n_queries=args.queries,
+        space=args.space,
+    )
+    if not results:
+        print(f"Collection '{args.collection}' is empty, nothing to tune.")
+        return
+    print(
+        f"Collection={args.collection} vectors={store.count()} "
+        f"exact brute force (numpy, one query at a time): "
+        f"p50={results[0]['exact_p50_ms']:.3f}ms p95={results[0]['exact_p95_ms']:.3f}ms"
+    )
+    print("HNSW latencies are single-query Chroma round trips (including id lookup).")
+    print(f"{'space':<8}{'M':>5}{'c_ef':>7}{'s_ef':>7}{'recall@' + str(args.top_k):>12}{'p50_ms':>10}{'p95_ms':>10}{'build_s':>10}")
+    for row in sorted(results, key=lambda r: (-r["recall"], r["p50_ms"])):
+        print(
+            f"{row['space']:<8}{row['M']:>5}{row['construction_ef']:>7}{row['search_ef']:>7}"
+            f"{row['recall']:>12.4f}{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}{row['build_s']:>10.2f}"
+        )
+
+
 def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Local Multimodal AI Agent")
     subparsers = parser.add_subparsers(dest="command", required=True)
@@ -74,10 +140,31 @@ def build_parser() -> argparse.ArgumentParser:
     search_image_parser = subparsers.add_parser("search_image", help="Search images with text")
     search_image_parser.add_argument("query", help="Natural language query for the target image")
     search_image_parser.add_argument("--top_k", type=int, default=3)
+
+    by_image_parser = subparsers.add_parser("search_image_by_image", help="Find similar images to a query image (JSON)")
+    by_image_parser.add_argument("path", help="Path to the query image")
+    by_image_parser.add_argument("--top_k", type=int, default=3)
+    by_image_parser.add_argument("--include_self", action="store_true", help="Keep the query image in results")
+
+    batch_parser = subparsers.add_parser("search_image_batch", help="Batch text/image queries against images (JSON)")
+    batch_parser.add_argument("--text", action="append", default=[], help="Text query (repeatable)")
+    batch_parser.add_argument("--image", action="append", default=[], help="Query image path (repeatable)")
+    batch_parser.add_argument("--top_k", type=int, default=3)
+    batch_parser.add_argument("--include_self", action="store_true", help="Keep query images in their results")
+    batch_parser.add_argument("--benchmark", action="store_true",
+                              help="Also time the batch against a per-query search loop (caches disabled)")
+    batch_parser.add_argument("--repeat", type=int, default=3, help="Timed repetitions for --benchmark")
     stats_parser = subparsers.add_parser("stats", help="Show index statistics")
 
     rebuild_parser = subparsers.add_parser("rebuild_index", help="Clear and rebuild paper/image index")
 
+    tune_parser = subparsers.add_parser("tune_index", help="Sweep HNSW settings: recall@k vs latency")
+    tune_parser.add_argument("--collection", choices=["papers", "images"], default="papers")
+    tune_parser.add_argument("--top_k", type=int, default=config.HNSW_TUNE_TOP_K)
+    tune_parser.add_argument("--queries", type=int, default=config.HNSW_TUNE_QUERIES)
+    tune_parser.add_argument("--space", choices=["cosine", "l2", "ip"], default=None,
+                             help="Distance space to tune (default: current collection space)")
+
     remove_parser = subparsers.add_parser("remove_paper", help="Remove a paper from index by its path")
     remove_parser.add_argument("path", help="Path to a PDF (must match stored 'source' path)")
 
@@ -97,12 +184,30 @@ def main() -> None:
         handle_search_paper(args, paper_manager)
     elif args.command == "search_image":
         handle_search_image(args, image_manager)
+    elif args.command == "search_image_by_image":
+        handle_search_image_by_image(args, image_manager)
+    elif args.command == "search_image_batch":
+        handle_search_image_batch(args, image_manager)
     elif args.command == "stats":
         print(f"Papers indexed chunks: {paper_manager.store.count()}")
         print(f"Images indexed: {image_manager.store.count()}")
         print(f"Library dir: {config.LIBRARY_DIR}")
         print(f"Paper DB: {config.PAPER_DB}")
         print(f"Image DB: {config.IMAGE_DB}")
+        print(f"Paper space: {paper_manager.store.space}, image space: {image_manager.store.space}")
+        # lifetime = 所有进程累计（CLI 每条命令都是新进程，本进程的 session 计数没有意义）
+        emb = paper_manager.embedding_manager.query_cache.stats()["lifetime"]
+        print(
+            f"Query embedding cache: hit_rate={emb['hit_rate']:.1%} "
+            f"(memory_hits={emb['memory_hits']}, disk_hits={emb['disk_hits']}, misses={emb['misses']})"
+        )
+        for name, cache in (("Paper", paper_manager.result_cache), ("Image", image_manager.result_cache)):
+            res = cache.stats()["lifetime"]
+            print(
+                f"{name} result cache: hit_rate={res['hit_rate']:.1%} "
+                f"(hits={res['hits']}, misses={res['misses']}, invalidations={res['invalidations']})"
+            )
+        print(f"Cache stats file: {config.CACHE_STATS_FILE}")
 
     elif args.command == "rebuild_index":
         LOGGER.info("Rebuilding paper index from library %s", config.LIBRARY_DIR)
@@ -112,6 +217,9 @@ def main() -> None:
         image_manager.index_folder(config.IMAGE_DIR)
         LOGGER.info("Done.")
 
+    elif args.command == "tune_index":
+        handle_tune_index(args, paper_manager, image_manager)
+
     elif args.command == "remove_paper":
         removed = paper_manager.delete_paper_by_source(Path(args.path))
         LOGGER.info("Removed %d chunks for %s", removed, args.path)
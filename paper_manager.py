@@ -11,6 +11,7 @@ from collections import defaultdict
 import config
 from embeddings import EmbeddingManager
 from pdf_utils import extract_text_chunks
+from query_cache import ResultCache, normalize_query
 from vector_store import VectorStore
 from text_filters import is_reference_like
 
@@ -24,6 +25,20 @@ class PaperManager:
         self.store = store
         # ---- 新增：topic embedding 缓存 ----
         self._topic_cache: Dict[Tuple[str, ...], np.ndarray] = {}
+        # 检索结果缓存：key=(方法, query, top_k, 过滤参数)，store.generation 变化即失效
+        self.result_cache = ResultCache(
+            int(getattr(config, "RESULT_CACHE_SIZE", 0)),
+            stats_file=getattr(config, "CACHE_STATS_FILE", None),
+            section="paper_results",
+        )
+
+    def _result_key(self, kind: str, query: str, top_k: int) -> Tuple:
+        filters = (
+            bool(getattr(config, "FILTER_REFERENCE_CHUNKS", True)),
+            int(getattr(config, "SEARCH_FETCH_MULTIPLIER", 8)),
+            int(getattr(config, "SNIPPETS_PER_PAPER", 2)),
+        )
+        return (kind, normalize_query(query, self.embedding_manager.text_uncased), int(top_k), filters)
 
     def organize_folder(self, folder: Path, topics: str) -> List[Dict[str, str]]:
         folder = folder.expanduser().resolve()
@@ -56,7 +71,13 @@ class PaperManager:
         return results
 
     def search(self, query: str, top_k: int) -> List[Dict[str, str]]:
-        query_embedding = self.embedding_manager.embed_text([query]).squeeze(0)
+        cache_key = self._result_key("search", query, top_k)
+        generation = self.store.generation
+        cached = self.result_cache.get(cache_key, generation)
+        if cached is not None:
+            return cached
+
+        query_embedding = self.embedding_manager.embed_query(query)
 
         # ✅ 先多取一些候选，再过滤 refs
         fetch_k = max(top_k * int(getattr(config, "SEARCH_FETCH_MULTIPLIER", 6)), top_k)
@@ -90,18 +111,17 @@ class PaperManager:
             if len(results) >= top_k:
                 break
 
+        self.result_cache.put(cache_key, generation, results)
         return results
 
     def search_grouped(self, query: str, top_k: int) -> List[Dict]:
-        def _distance_to_score(dist: float) -> float:
-            # 常见情况：cosine distance = 1 - cosine_sim
-            # 转成“越大越好”的相似度近似
-            try:
-                return 1.0 - float(dist)
-            except Exception:
-                return 0.0
+        cache_key = self._result_key("grouped", query, top_k)
+        generation = self.store.generation
+        cached = self.result_cache.get(cache_key, generation)
+        if cached is not None:
+            return cached
 
-        query_embedding = self.embedding_manager.embed_text([query]).squeeze(0)
+        query_embedding = self.embedding_manager.embed_query(query)
 
         fetch_k = max(
             top_k * int(getattr(config, "SEARCH_FETCH_MULTIPLIER", 8)),
@@ -122,7 +142,8 @@ class PaperManager:
             topic = meta.get("topic", "")
             chunk_idx = meta.get("chunk_idx", "")
             dist = distances[i] if i < len(distances) else 1.0
-            score = _distance_to_score(dist)
+            # 按 collection 实际的 space 把 distance 转成相似度
+            score = self.store.distance_to_score(dist)
 
             grouped[source].append({
                 "score": score,
@@ -155,7 +176,9 @@ class PaperManager:
 
         # 3) 论文按最佳分数排序，返回 top_k 篇
         paper_results.sort(key=lambda x: x["best_score"], reverse=True)
-        return paper_results[:top_k]
+        paper_results = paper_results[:top_k]
+        self.result_cache.put(cache_key, generation, paper_results)
+        return paper_results
 
     def _canonical_path(self, pdf_path: Path) -> Path:
         pdf_path = pdf_path.expanduser().resolve()
@@ -0,0 +1,312 @@
+import atexit
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def normalize_query(text: str, lowercase: bool = True) -> str:
+    # 只用来构造缓存 key：合并空白；tokenizer 不区分大小写时再转小写
+    text = " ".join((text or "").split())
+    return text.lower() if lowercase else text
+
+
+def _hit_rate(hits: int, misses: int) -> float:
+    total = hits + misses
+    return hits / total if total else 0.0
+
+
+class CacheStatsFile:
+    """
+    Cumulative cache counters shared by all processes, stored as a small JSON file
+    ({section: {counter: n}}). Each cache adds its own deltas on exit.
+    """
+
+    def __init__(self, path: Optional[Path]) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def read(self) -> Dict[str, Dict[str, int]]:
+        if self.path is None or not self.path.exists():
+            return {}
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except Exception as exc:  # pragma: no cover - corrupted file
+            LOGGER.warning("Ignoring unreadable cache stats %s: %s", self.path, exc)
+            return {}
+
+    def add(self, section: str, deltas: Dict[str, int]) -> None:
+        if self.path is None or not any(deltas.values()):
+            return
+        with self._lock:
+            try:
+                data = self.read()
+                counters = data.setdefault(section, {})
+                for name, value in deltas.items():
+                    counters[name] = int(counters.get(name, 0)) + int(value)
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self.path.with_suffix(f".{os.getpid()}-{threading.get_ident()}.tmp")
+                tmp.write_text(json.dumps(data, indent=2), encoding="utf-8")
+                os.replace(tmp, self.path)
+            except Exception as exc:  # pragma: no cover - defensive
+                LOGGER.warning("Failed to save cache stats to %s: %s", self.path, exc)
+
+
+class _PersistentCounters:
+    """Per-process counters that are merged into a CacheStatsFile section at exit."""
+
+    def __init__(self, names: List[str], stats_file: Optional[Path], section: str) -> None:
+        self.counts: Dict[str, int] = {name: 0 for name in names}
+        self._flushed: Dict[str, int] = dict(self.counts)
+        self._file = CacheStatsFile(stats_file)
+        self._section = section
+        if stats_file is not None:
+            atexit.register(self.flush)
+
+    def incr(self, name: str) -> None:
+        self.counts[name] += 1
+
+    def flush(self) -> None:
+        deltas = {name: self.counts[name] - self._flushed[name] for name in self.counts}
+        self._file.add(self._section, deltas)
+        self._flushed = dict(self.counts)
+
+    def lifetime(self) -> Dict[str, int]:
+        # 文件里的累计值 + 本进程尚未写回的部分
+        saved = self._file.read().get(self._section, {})
+        return {
+            name: int(saved.get(name, 0)) + self.counts[name] - self._flushed[name] for name in self.counts
+        }
+
+
+class LRUCache:
+    """In-process LRU with hit/miss counters."""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max(0, int(max_size))
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.max_size == 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class EmbeddingCache:
+    """
+    Query-embedding cache keyed by (model, normalized query).
+    Memory LRU in front of an optional on-disk .npy store (LRU by mtime).
+    The encoder always receives the original query text; normalization only builds the key.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        cache_dir: Optional[Path] = None,
+        max_disk_entries: int = 0,
+        stats_file: Optional[Path] = None,
+    ) -> None:
+        self.memory = LRUCache(max_size)
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max(0, int(max_disk_entries))
+        self.counters = _PersistentCounters(["memory_hits", "disk_hits", "misses"], stats_file, "query_embedding")
+        self._disk_count = 0
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            # 只在启动时数一次；之后靠计数判断是否需要淘汰
+            self._disk_count = sum(1 for _ in self.cache_dir.glob("*.npy"))
+
+    def _disk_path(self, model: str, query: str) -> Path:
+        digest = hashlib.sha1(f"{model}\n{query}".encode("utf-8")).hexdigest()
+        return self.cache_dir / f"{digest}.npy"
+
+    def _read_disk(self, model: str, query: str) -> Optional[np.ndarray]:
+        if self.cache_dir is None:
+            return None
+        path = self._disk_path(model, query)
+        if not path.exists():
+            return None
+        try:
+            vec = np.load(path, allow_pickle=False)
+            path.touch()
+            return vec
+        except Exception as exc:  # pragma: no cover - corrupted file
+            LOGGER.warning("Dropping unreadable query cache entry %s: %s", path, exc)
+            path.unlink(missing_ok=True)
+            return None
+
+    def _write_disk(self, model: str, query: str, vec: np.ndarray) -> None:
+        if self.cache_dir is None:
+            return
+        try:
+            path = self._disk_path(model, query)
+            is_new = not path.exists()
+            # 先写临时文件再原子替换，其他进程不会读到写了一半的 .npy
+            tmp = path.with_suffix(f".{os.getpid()}-{threading.get_ident()}.tmp")
+            try:
+                with open(tmp, "wb") as f:
+                    np.save(f, vec, allow_pickle=False)
+                os.replace(tmp, path)
+            except Exception:
+                tmp.unlink(missing_ok=True)
+                raise
+            if is_new:
+                self._disk_count += 1
+            if self.max_disk_entries and self._disk_count > self.max_disk_entries:
+                self._evict_disk()
+        except Exception as exc:  # pragma: no cover - defensive
+            LOGGER.warning("Failed to write query cache to %s: %s", self.cache_dir, exc)
+
+    def _evict_disk(self) -> None:
+        # 超限时才扫描一次目录，按最近使用时间批量淘汰到上限的 90%
+        files = sorted(self.cache_dir.glob("*.npy"), key=lambda p: p.stat().st_mtime)
+        target = int(self.max_disk_entries * 0.9)
+        for stale in files[: max(0, len(files) - target)]:
+            stale.unlink(missing_ok=True)
+        self._disk_count = min(len(files), target)
+
+    def _lookup(self, key: Tuple[str, str]) -> Optional[np.ndarray]:
+        vec = self.memory.get(key)
+        if vec is not None:
+            self.counters.incr("memory_hits")
+            return vec
+        vec = self._read_disk(*key)
+        if vec is not None:
+            self.counters.incr("disk_hits")
+            vec.flags.writeable = False
+            self.memory.put(key, vec)
+        return vec
+
+    def _store(self, key: Tuple[str, str], vec: np.ndarray) -> None:
+        self._write_disk(key[0], key[1], vec)
+        vec.flags.writeable = False
+        self.memory.put(key, vec)
+
+    def get_or_compute(
+        self, model: str, query: str, compute: Callable[[str], np.ndarray], lowercase: bool = True
+    ) -> np.ndarray:
+        key = (model, normalize_query(query, lowercase))
+        vec = self._lookup(key)
+        if vec is None:
+            self.counters.incr("misses")
+            vec = np.asarray(compute(query))
+            self._store(key, vec)
+        return vec
+
+    def get_or_compute_many(
+        self,
+        model: str,
+        queries: List[str],
+        compute_many: Callable[[List[str]], np.ndarray],
+        lowercase: bool = True,
+    ) -> np.ndarray:
+        """Like get_or_compute, but all misses go through a single `compute_many` call."""
+        keys = [(model, normalize_query(q, lowercase)) for q in queries]
+        vecs = [self._lookup(key) for key in keys]
+
+        # 同一 key 只编码一次，送进模型的是第一次出现时的原始文本
+        missing: Dict[Tuple[str, str], str] = {}
+        for key, query, vec in zip(keys, queries, vecs):
+            if vec is None and key not in missing:
+                missing[key] = query
+        if missing:
+            for _ in missing:
+                self.counters.incr("misses")
+            computed = dict(zip(missing, np.asarray(compute_many(list(missing.values())))))
+            for key, vec in computed.items():
+                self._store(key, vec)
+            vecs = [vec if vec is not None else computed[key] for key, vec in zip(keys, vecs)]
+        return np.stack(vecs) if vecs else np.empty((0, 0), dtype=np.float32)
+
+    def stats(self) -> Dict[str, Any]:
+        # 命中 = 内存命中 + 磁盘命中；lifetime 为所有进程累计（CLI 每次都是新进程，看这一项）
+        session = dict(self.counters.counts)
+        lifetime = self.counters.lifetime()
+        stats: Dict[str, Any] = {"size": len(self.memory), "max_size": self.memory.max_size}
+        for name, counts in (("session", session), ("lifetime", lifetime)):
+            hits = counts["memory_hits"] + counts["disk_hits"]
+            stats[name] = {**counts, "hit_rate": _hit_rate(hits, counts["misses"])}
+        stats["disk_dir"] = str(self.cache_dir) if self.cache_dir is not None else ""
+        return stats
+
+
+class ResultCache:
+    """
+    Search-result LRU keyed by (query, top_k, filters).
+    Entries are only valid for the store generation they were computed at;
+    any add/remove/rebuild (from any process) bumps the generation and drops everything.
+    Callers read `store.generation` once per search and pass it to both get and put.
+    """
+
+    def __init__(self, max_size: int, stats_file: Optional[Path] = None, section: str = "results") -> None:
+        self.cache = LRUCache(max_size)
+        self.generation: Optional[Hashable] = None
+        self.counters = _PersistentCounters(["hits", "misses", "invalidations"], stats_file, section)
+
+    def _sync(self, generation: Hashable) -> None:
+        if generation != self.generation:
+            if self.generation is not None:
+                self.counters.incr("invalidations")
+            self.cache.clear()
+            self.generation = generation
+
+    def get(self, key: Hashable, generation: Hashable) -> Optional[Any]:
+        self._sync(generation)
+        value = self.cache.get(key)
+        self.counters.incr("hits" if value is not None else "misses")
+        # 返回副本，调用方改结果不会污染缓存
+        return copy.deepcopy(value) if value is not None else None
+
+    def put(self, key: Hashable, generation: Hashable, value: Any) -> None:
+        self._sync(generation)
+        self.cache.put(key, copy.deepcopy(value))
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {"size": len(self.cache), "max_size": self.cache.max_size}
+        for name, counts in (("session", dict(self.counters.counts)), ("lifetime", self.counters.lifetime())):
+            stats[name] = {**counts, "hit_rate": _hit_rate(counts["hits"], counts["misses"])}
+        stats["generation"] = self.generation
+        return stats
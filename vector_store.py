@@ -1,20 +1,115 @@
 import logging
+import os
+import uuid
 from pathlib import Path
-from typing import Any, Dict, List, Sequence
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import numpy as np
 import chromadb
+import chromadb.errors
 
 
 LOGGER = logging.getLogger(__name__)
 
+# get_collection 找不到 collection 时抛的异常，随 Chroma 版本不同：
+# <=0.5 为 ValueError / InvalidCollectionException，>=0.6 为 NotFoundError
+_COLLECTION_NOT_FOUND = (ValueError,) + tuple(
+    getattr(chromadb.errors, name)
+    for name in ("NotFoundError", "InvalidCollectionException")
+    if hasattr(chromadb.errors, name)
+)
+
+# Chroma 未显式指定 space 时的默认值
+DEFAULT_SPACE = "l2"
+_HNSW_KEYS = ("space", "M", "construction_ef", "search_ef")
+
+
+def hnsw_metadata(hnsw: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    # {"space": "cosine", "M": 16} -> {"hnsw:space": "cosine", "hnsw:M": 16}
+    if not hnsw:
+        return None
+    return {f"hnsw:{key}": hnsw[key] for key in _HNSW_KEYS if hnsw.get(key) is not None}
+
+
+def distance_to_score(dist: float, space: str) -> float:
+    # 把 Chroma 返回的 distance 转成“越大越好”的相似度（对归一化向量即 cosine sim）
+    try:
+        d = float(dist)
+    except Exception:
+        return 0.0
+    if space == "l2":
+        # Chroma 的 l2 是平方欧氏距离：||a-b||^2 = 2 - 2cos
+        return 1.0 - d / 2.0
+    # cosine: 1 - cos；ip: 1 - a·b
+    return 1.0 - d
+
 
 class VectorStore:
-    def __init__(self, storage_path: Path, collection_name: str) -> None:
+    def __init__(
+        self,
+        storage_path: Path,
+        collection_name: str,
+        hnsw: Optional[Dict[str, Any]] = None,
+    ) -> None:
         storage_path.parent.mkdir(parents=True, exist_ok=True)
         self.client = chromadb.PersistentClient(path=str(storage_path))
-        self.collection = self.client.get_or_create_collection(name=collection_name, embedding_function=None)
-        LOGGER.info("Connected to Chroma collection=%s at %s", collection_name, storage_path)
+        self.hnsw = dict(hnsw or {})
+        # 每次写入/删除/重建都会改写这个文件，结果缓存据此失效（跨进程可见）
+        self._generation_file = storage_path / f"{collection_name}.generation"
+        self.collection = self._open_collection(collection_name)
+        LOGGER.info(
+            "Connected to Chroma collection=%s at %s (space=%s)", collection_name, storage_path, self.space
+        )
+
+    def _open_collection(self, name: str):
+        try:
+            collection = self.client.get_collection(name=name, embedding_function=None)
+        except _COLLECTION_NOT_FOUND:
+            # 不存在：按配置的 HNSW 参数新建
+            return self.client.create_collection(
+                name=name, embedding_function=None, metadata=hnsw_metadata(self.hnsw)
+            )
+        # 已存在：HNSW 参数在创建后不可改，只提示需要 rebuild_index 迁移
+        wanted = hnsw_metadata(self.hnsw) or {}
+        current = collection.metadata or {}
+        stale = {
+            key: (current.get(key), value)
+            for key, value in wanted.items()
+            if current.get(key, DEFAULT_SPACE if key == "hnsw:space" else None) != value
+        }
+        if stale:
+            LOGGER.warning(
+                "Collection %s HNSW settings differ from config %s; run rebuild_index to migrate",
+                name,
+                stale,
+            )
+        return collection
+
+    @property
+    def generation(self) -> str:
+        # 每次都从磁盘读：其他进程的 add_paper / remove_paper / rebuild_index 也能被看到
+        try:
+            return self._generation_file.read_text(encoding="utf-8").strip()
+        except FileNotFoundError:
+            return ""
+
+    def _bump_generation(self) -> None:
+        # "<计数>-<随机后缀>"：两个进程同时 bump 读到同一计数时也不会写出相同的值
+        try:
+            count = int(self.generation.split("-", 1)[0]) + 1
+        except ValueError:
+            count = 1
+        token = uuid.uuid4().hex[:8]
+        tmp = self._generation_file.with_suffix(f".{os.getpid()}-{token}.tmp")
+        tmp.write_text(f"{count}-{token}", encoding="utf-8")
+        os.replace(tmp, self._generation_file)
+
+    @property
+    def space(self) -> str:
+        return str((self.collection.metadata or {}).get("hnsw:space", DEFAULT_SPACE))
+
+    def distance_to_score(self, dist: float) -> float:
+        return distance_to_score(dist, self.space)
 
     def upsert(
         self,
@@ -29,6 +124,7 @@ class VectorStore:
             metadatas=metadatas,
             documents=documents,
         )
+        self._bump_generation()
 
     def query(self, query_embedding: np.ndarray, top_k: int) -> chromadb.api.models.Collection.QueryResult:
         try:
@@ -45,17 +141,45 @@ class VectorStore:
                 include=["metadatas", "documents"],
             )
 
+    def query_many(self, query_embeddings: np.ndarray, top_k: int) -> chromadb.api.models.Collection.QueryResult:
+        # 多条 query 一次查询；结果的每个字段都是按 query 排列的列表
+        try:
+            return self.collection.query(
+                query_embeddings=query_embeddings.tolist(),
+                n_results=top_k,
+                include=["metadatas", "documents", "distances"],
+            )
+        except ValueError:
+            return self.collection.query(
+                query_embeddings=query_embeddings.tolist(),
+                n_results=top_k,
+                include=["metadatas", "documents"],
+            )
+
+    def find_embeddings(self, where: Dict[str, Any]) -> List[Tuple[Dict[str, Any], np.ndarray]]:
+        # 按 metadata 过滤取已存向量，返回 [(metadata, vector)]
+        data = self.collection.get(where=where, include=["metadatas", "embeddings"])
+        metas = data.get("metadatas") or []
+        embeddings = data.get("embeddings")
+        if embeddings is None:
+            return []
+        return [(meta or {}, np.asarray(vec, dtype=np.float32)) for meta, vec in zip(metas, embeddings)]
+
     def count(self) -> int:
         return int(self.collection.count())
 
     def delete(self, ids: Sequence[str]) -> None:
         self.collection.delete(ids=list(ids))
+        self._bump_generation()
 
     def reset(self) -> None:
-        # 删除整个 collection 并重建
+        # 删除整个 collection 并按当前配置的 HNSW 参数重建（即迁移）
         name = self.collection.name
         self.client.delete_collection(name=name)
-        self.collection = self.client.get_or_create_collection(name=name, embedding_function=None)
+        self.collection = self.client.create_collection(
+            name=name, embedding_function=None, metadata=hnsw_metadata(self.hnsw)
+        )
+        self._bump_generation()
 
     def get_all_ids_and_meta(self) -> List[tuple]:
         # 用于 remove_paper：取出所有 id + metadata（小规模作业足够用）
@@ -63,3 +187,12 @@ class VectorStore:
         ids = data.get("ids", [])
         metas = data.get("metadatas", [])
         return list(zip(ids, metas))
+
+    def get_all_embeddings(self) -> Tuple[List[str], np.ndarray]:
+        # 用于 tune_index：取出全部向量做暴力精确检索
+        data = self.collection.get(include=["embeddings"])
+        ids = list(data.get("ids", []))
+        embeddings = data.get("embeddings")
+        if embeddings is None or len(ids) == 0:
+            return ids, np.empty((0, 0), dtype=np.float32)
+        return ids, np.asarray(embeddings, dtype=np.float32)